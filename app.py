@@ -1,18 +1,11 @@
 
 import streamlit as st
-import pandas as pd
-from logic import process_reconciliation
+import hashlib
 import io
+from python_calamine import CalamineWorkbook
 
-st.set_page_config(
-    page_title="Conciliación Bancaria",
-    page_icon="🏦",
-    layout="wide",
-    initial_sidebar_state="expanded"
-)
-
-# --- Custom CSS ---
-st.markdown("""
+# --- Static page content (built once at import) ---
+_CSS = """
 <style>
     .main {
         background-color: #f8f9fa;
@@ -48,7 +41,94 @@ st.markdown("""
         color: #0d47a1;
     }
 </style>
-""", unsafe_allow_html=True)
+"""
+
+_SIDEBAR_INFO = """
+    1. **Sube el Libro**: Excel de tu sistema contable con las transacciones registradas.
+    2. **Sube el Extracto**: Excel del banco con los movimientos bancarios.
+    3. **Procesa**: El sistema identificará:
+       - ✅ **Items que coinciden**
+       - 🕐 **Diferencias Temporales** (depósitos en tránsito, cheques pendientes)
+       - ⚠️ **Diferencias Permanentes** (comisiones, impuestos, errores)
+    4. **Descarga**: Obtén el reporte de conciliación completo.
+    """
+
+st.set_page_config(
+    page_title="Conciliación Bancaria",
+    page_icon="🏦",
+    layout="wide",
+    initial_sidebar_state="expanded"
+)
+
+
+# --- Cached parsing ---
+# Uploads are keyed by a blake2b digest of their bytes; the underscore-prefixed
+# arguments are skipped by st.cache_data's hasher so the bytes and DataFrames
+# are not re-hashed on every rerun.
+def _file_digest(data: bytes) -> bytes:
+    return hashlib.blake2b(data, digest_size=16).digest()
+
+
+@st.cache_data(show_spinner=False)
+def _read_preview_cached(file_hash: bytes, _data: bytes, header: int = 0, nrows: int = 3):
+    # pandas is imported lazily so a cold session renders before it loads
+    import pandas as pd
+
+    # Only pull the header row plus the preview rows from the first sheet
+    sheet = CalamineWorkbook.from_filelike(io.BytesIO(_data)).get_sheet_by_index(0)
+    rows = sheet.to_python(skip_empty_area=False, nrows=header + 1 + nrows)
+    # Same header cleanup read_excel does: blank names become 'Unnamed: i' and
+    # repeated names get '.1', '.2', ... (Streamlit rejects duplicate columns)
+    names = [col if col != '' else f'Unnamed: {i}' for i, col in enumerate(rows[header])]
+    columns = []
+    counts = {}
+    for name in names:
+        col, count = name, counts.get(name, 0)
+        while count > 0:
+            counts[name] = count + 1
+            col = f'{name}.{count}'
+            # Skip suffixes that already appear as a header further along
+            count = count + 1 if col in names else counts.get(col, 0)
+        columns.append(col)
+        counts[col] = count + 1
+    return pd.DataFrame(rows[header + 1:], columns=columns)
+
+
+@st.cache_data(show_spinner=False)
+def _parse_libro(file_hash: bytes, _data: bytes):
+    from logic import read_libro
+
+    return read_libro(io.BytesIO(_data))
+
+
+@st.cache_data(show_spinner=False)
+def _parse_extracto(file_hash: bytes, _data: bytes):
+    from logic import read_extracto
+
+    return read_extracto(io.BytesIO(_data))
+
+
+@st.cache_data(show_spinner=False)
+def _run_reconciliation(libro_hash: bytes, extracto_hash: bytes, _df_libro, _df_extracto):
+    from logic import process_reconciliation
+
+    output, summary = process_reconciliation(_df_libro, _df_extracto)
+
+    # Currency strings for the metrics, formatted once per uploaded pair
+    # Money keys listed explicitly: a total can come back as int (e.g. zero-sum)
+    money_keys = (
+        'saldo_final_banco',
+        'saldo_final_libro',
+        'diferencia_total',
+        'diferencias_temporales_monto',
+        'diferencias_permanentes_monto',
+    )
+    fmt = {k: f"${summary[k]:,.2f}" for k in money_keys}
+    fmt['diferencia_total_abs'] = f"${abs(summary['diferencia_total']):,.2f}"
+    return output.getvalue(), summary, fmt
+
+# --- Custom CSS ---
+st.markdown(_CSS, unsafe_allow_html=True)
 
 st.title("🏦 Conciliación Bancaria Automática")
 st.markdown("""
@@ -60,15 +140,7 @@ entre el saldo del Libro y el saldo del Extracto Bancario.
 with st.sidebar:
     st.image("https://img.icons8.com/fluency/96/000000/bank.png", width=80)
     st.title("Instrucciones")
-    st.info("""
-    1. **Sube el Libro**: Excel de tu sistema contable con las transacciones registradas.
-    2. **Sube el Extracto**: Excel del banco con los movimientos bancarios.
-    3. **Procesa**: El sistema identificará:
-       - ✅ **Items que coinciden**
-       - 🕐 **Diferencias Temporales** (depósitos en tránsito, cheques pendientes)
-       - ⚠️ **Diferencias Permanentes** (comisiones, impuestos, errores)
-    4. **Descarga**: Obtén el reporte de conciliación completo.
-    """)
+    st.info(_SIDEBAR_INFO)
     
     st.divider()
     st.subheader("📚 ¿Qué son las diferencias?")
@@ -97,10 +169,12 @@ with col1:
     st.subheader("1. Subir 'Libro Banco' (Excel)")
     libro_file = st.file_uploader("Cargar archivo del Libro", type=["xlsx", "xls"], key="libro")
     if libro_file:
+        libro_bytes = libro_file.getvalue()
+        libro_hash = _file_digest(libro_bytes)
         try:
-            df_preview = pd.read_excel(libro_file, header=1, nrows=3)
+            df_preview = _read_preview_cached(libro_hash, libro_bytes, header=1)
             st.caption("Vista previa del Libro:")
-            st.dataframe(df_preview, use_container_width=True)
+            st.table(df_preview)
         except Exception:
             st.error("Error al leer la vista previa del Libro.")
 
@@ -108,18 +182,29 @@ with col2:
     st.subheader("2. Subir 'Extracto Bancario' (Excel)")
     extracto_file = st.file_uploader("Cargar archivo del Banco", type=["xlsx", "xls"], key="extracto")
     if extracto_file:
+        extracto_bytes = extracto_file.getvalue()
+        extracto_hash = _file_digest(extracto_bytes)
         try:
-            df_preview_b = pd.read_excel(extracto_file, nrows=3)
+            df_preview_b = _read_preview_cached(extracto_hash, extracto_bytes)
             st.caption("Vista previa del Extracto:")
-            st.dataframe(df_preview_b, use_container_width=True)
+            st.table(df_preview_b)
         except Exception:
             st.error("Error al leer la vista previa del Banco.")
 
-if libro_file and extracto_file:
+# --- Processing section ---
+# Runs as a fragment: clicking the button only reruns this section, not the
+# uploaders and previews above it.
+@st.fragment
+def _reconciliation_fragment(libro_hash, libro_bytes, extracto_hash, extracto_bytes):
     if st.button("🔄 Ejecutar Conciliación Bancaria"):
         with st.spinner("Procesando conciliación bancaria..."):
             try:
-                output_excel, summary = process_reconciliation(libro_file, extracto_file)
+                output_excel, summary, fmt = _run_reconciliation(
+                    libro_hash,
+                    extracto_hash,
+                    _parse_libro(libro_hash, libro_bytes),
+                    _parse_extracto(extracto_hash, extracto_bytes)
+                )
                 
                 st.success("✅ ¡Conciliación completada!")
                 
@@ -131,20 +216,20 @@ if libro_file and extracto_file:
                 with col_a:
                     st.metric(
                         "💰 Saldo Final Banco", 
-                        f"${summary['saldo_final_banco']:,.2f}",
+                        fmt['saldo_final_banco'],
                         help="Saldo según extracto bancario"
                     )
                 with col_b:
                     st.metric(
                         "📚 Saldo Final Libro", 
-                        f"${summary['saldo_final_libro']:,.2f}",
+                        fmt['saldo_final_libro'],
                         help="Saldo según registros contables"
                     )
                 with col_c:
                     diferencia = summary['diferencia_total']
                     st.metric(
                         "📊 Diferencia Total", 
-                        f"${abs(diferencia):,.2f}",
+                        fmt['diferencia_total_abs'],
                         delta=f"{'Faltante' if diferencia < 0 else 'Excedente'}",
                         delta_color="inverse" if diferencia < 0 else "normal",
                         help="Diferencia entre Libro y Banco"
@@ -168,7 +253,7 @@ if libro_file and extracto_file:
                     st.metric(
                         "🕐 Diferencias Temporales",
                         summary['diferencias_temporales_count'],
-                        f"${summary['diferencias_temporales_monto']:,.2f}",
+                        fmt['diferencias_temporales_monto'],
                         help="Se ajustan sin asiento contable"
                     )
                 
@@ -176,7 +261,7 @@ if libro_file and extracto_file:
                     st.metric(
                         "⚠️ Diferencias Permanentes",
                         summary['diferencias_permanentes_count'],
-                        f"${summary['diferencias_permanentes_monto']:,.2f}",
+                        fmt['diferencias_permanentes_monto'],
                         help="Requieren ajuste contable"
                     )
                 
@@ -202,7 +287,7 @@ if libro_file and extracto_file:
                    - Acreditaciones u omisiones de registro
                    - **Ajuste**: Requieren asiento contable para corregir
                 
-                4. **Resultado**: La diferencia total de **${abs(summary['diferencia_total']):,.2f}** se explica por la suma 
+                4. **Resultado**: La diferencia total de **{fmt['diferencia_total_abs']}** se explica por la suma 
                    de diferencias temporales y permanentes.
                 """)
                 
@@ -234,5 +319,8 @@ if libro_file and extracto_file:
                 st.error(f"❌ Error durante la conciliación: {e}")
                 st.exception(e)
 
+
+if libro_file and extracto_file:
+    _reconciliation_fragment(libro_hash, libro_bytes, extracto_hash, extracto_bytes)
 else:
     st.info("👆 Por favor sube ambos archivos para comenzar la conciliación bancaria.")
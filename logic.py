@@ -1,7 +1,9 @@
 
+import numpy as np
 import pandas as pd
 import re
 import io
+import warnings
 
 def clean_amount(val):
     """
@@ -10,7 +12,7 @@ def clean_amount(val):
     """
     if pd.isna(val):
         return 0.0
-    if isinstance(val, (float, int)):
+    if isinstance(val, (float, int, np.number)):
         return float(val)
     if isinstance(val, str):
         # Remove dots (thousands), replace comma with dot (decimal)
@@ -22,6 +24,58 @@ def clean_amount(val):
     return 0.0
 
 
+def clean_amount_series(s):
+    """
+    Vectorized version of clean_amount for a whole column.
+    Numeric cells are kept as-is, text cells get the same '.'/',' swap,
+    and anything else (or unparseable) becomes 0.0.
+    """
+    if pd.api.types.is_numeric_dtype(s):
+        return s.astype('float64').fillna(0.0)
+
+    if pd.api.types.infer_dtype(s, skipna=True) == 'string':
+        is_text = s.notna()
+        is_number = pd.Series(False, index=s.index)
+    else:
+        # Mixed column (e.g. numeric cells next to '1.050,00' text cells)
+        # isinstance so numpy scalars (np.float64, np.int64) count as numbers too
+        is_text = s.map(lambda v: isinstance(v, str)).astype(bool)
+        is_number = s.map(lambda v: isinstance(v, (int, float, np.number))).astype(bool)
+
+    # strip() like float() does, exported files often pad with '\xa0'
+    text = s[is_text].astype(str).str.strip()
+    text = text.str.replace('.', '', regex=False).str.replace(',', '.', regex=False)
+
+    result = pd.Series(0.0, index=s.index)
+    result[is_text] = pd.to_numeric(text, errors='coerce')
+    result[is_number] = s[is_number].astype('float64')
+    return result.fillna(0.0)
+
+
+def parse_dates(s, date_format='%d/%m/%Y'):
+    """
+    Parses a date column. Columns Excel already stored as dates are returned
+    as-is; text dates are parsed with an explicit day-first format, then
+    ISO 8601 ('2024-03-05'), and only what is still left goes through the
+    per-value day-first parse.
+    """
+    if pd.api.types.is_datetime64_any_dtype(s):
+        return s
+    if pd.api.types.is_numeric_dtype(s):
+        # Excel serial dates read as numbers (45000 -> 2023-03-15)
+        return pd.to_datetime(s, unit='D', origin='1899-12-30', errors='coerce')
+    parsed = pd.to_datetime(s, format=date_format, errors='coerce', cache=True)
+    for fallback in ({'format': 'ISO8601'}, {'format': 'mixed', 'dayfirst': True}):
+        unparsed = parsed.isna() & s.notna()
+        if not unparsed.any():
+            break
+        # utc=True so 'Z'/offset suffixes don't raise; drop the tz and cast to
+        # parsed's unit so the assignment doesn't mix resolutions
+        fixed = pd.to_datetime(s[unparsed], errors='coerce', utc=True, **fallback)
+        parsed[unparsed] = fixed.dt.tz_localize(None).astype(parsed.dtype)
+    return parsed
+
+
 def clean_cuit(val):
     """
     Cleans CUIT/CUIL strings.
@@ -39,6 +93,10 @@ def clean_cuit(val):
         return val_clean
     return None
 
+# Digits inside parentheses, e.g. '(36142161)'
+_CHECK_NUMBER_RE = re.compile(r'\((\d+)\)')
+
+
 def extract_check_numbers(text):
     """
     Extracts all sequences of digits inside parentheses from the text.
@@ -46,9 +104,87 @@ def extract_check_numbers(text):
     """
     if not isinstance(text, str):
         return []
-    # Regex to find digits inside ()
-    matches = re.findall(r'\((\d+)\)', text)
-    return matches
+    return _CHECK_NUMBER_RE.findall(text)
+
+
+# Permanent differences keywords (require accounting entries)
+PERMANENT_KEYWORDS = {
+    'comision': 'Comisiones',
+    'impuesto': 'Impuestos y percepciones',
+    'imp.': 'Impuestos y percepciones',
+    'percep': 'Impuestos y percepciones',
+    'debito automatico': 'Débito automático',
+    'debito autom': 'Débito automático',
+    'sueldo': 'Sueldos y cargas sociales',
+    'carga social': 'Sueldos y cargas sociales',
+    'rechazo': 'Cheques rechazados',
+    'devuelto': 'Cheques rechazados',
+    'anulacion': 'Anulaciones',
+    'ley 25413': 'Impuestos y percepciones',
+    'ing. bruto': 'Impuestos y percepciones',
+    'ingresos brutos': 'Impuestos y percepciones'
+}
+
+# Temporary differences keywords (adjust without accounting entries)
+TEMPORARY_KEYWORDS = {
+    'acreditacion': 'Acreditaciones en tránsito',
+    'transferencia': 'Transferencias transitorias',
+    'transito': 'Depósitos en tránsito',
+    'tránsito': 'Depósitos en tránsito',
+    'en tránsito': 'Depósitos en tránsito',
+    'en transito': 'Depósitos en tránsito',
+    'prisma': 'Acreditaciones tarjetas',
+    'tarjeta': 'Acreditaciones tarjetas'
+}
+
+
+def _keyword_regex(keywords):
+    """
+    Compiles the keywords into one regex with a capture group per keyword.
+    Each alternative is a lookahead anchored at the start, so the first keyword
+    in dict order wins (not the leftmost occurrence), same as a loop of `in` checks.
+    """
+    alternatives = '|'.join(f'(?=.*?({re.escape(k)}))' for k in keywords)
+    return re.compile(rf'\A(?:{alternatives})', re.DOTALL)
+
+
+# Flat category columns added to the unmatched frames by categorize_series
+CATEGORY_COLUMNS = ['Cat_is_temporary', 'Cat_subcategory', 'Cat_requires_entry']
+
+_PERMANENT_RE = _keyword_regex(PERMANENT_KEYWORDS)
+_TEMPORARY_RE = _keyword_regex(TEMPORARY_KEYWORDS)
+_PERMANENT_SUBCATEGORIES = list(PERMANENT_KEYWORDS.values())
+_TEMPORARY_SUBCATEGORIES = list(TEMPORARY_KEYWORDS.values())
+
+# Every subcategory categorize_series can produce, keyword ones plus the two
+# defaults. Sorted so groupby on the categorical keeps alphabetical order.
+ALL_SUBCATEGORIES = sorted(set(
+    _PERMANENT_SUBCATEGORIES + _TEMPORARY_SUBCATEGORIES
+    + ['Depósitos en tránsito', 'Notas de débito/crédito omitidas']
+))
+SUBCATEGORY_DTYPE = pd.CategoricalDtype(ALL_SUBCATEGORIES)
+_PERMANENT_CODES = np.array([ALL_SUBCATEGORIES.index(s) for s in _PERMANENT_SUBCATEGORIES], dtype=np.int8)
+_TEMPORARY_CODES = np.array([ALL_SUBCATEGORIES.index(s) for s in _TEMPORARY_SUBCATEGORIES], dtype=np.int8)
+
+
+def _category(subcategory, is_temporary):
+    return {
+        'category': 'Temporal' if is_temporary else 'Permanente',
+        'subcategory': subcategory,
+        'requires_accounting_entry': not is_temporary,
+        'is_temporary': is_temporary
+    }
+
+
+def _default_category(source):
+    """
+    (subcategory, is_temporary) for items no keyword matched.
+    """
+    if source == 'libro':
+        # Item in books but not in bank = likely deposit in transit
+        return 'Depósitos en tránsito', True
+    # Item in bank but not in books = likely omitted entry
+    return 'Notas de débito/crédito omitidas', False
 
 
 def categorize_difference(row, source='extracto'):
@@ -64,132 +200,160 @@ def categorize_difference(row, source='extracto'):
     """
     descripcion = str(row.get('Descripcion', row.get('Concepto', ''))).lower()
     
-    # Permanent differences keywords (require accounting entries)
-    permanent_keywords = {
-        'comision': 'Comisiones',
-        'impuesto': 'Impuestos y percepciones',
-        'imp.': 'Impuestos y percepciones',
-        'percep': 'Impuestos y percepciones',
-        'debito automatico': 'Débito automático',
-        'debito autom': 'Débito automático',
-        'sueldo': 'Sueldos y cargas sociales',
-        'carga social': 'Sueldos y cargas sociales',
-        'rechazo': 'Cheques rechazados',
-        'devuelto': 'Cheques rechazados',
-        'anulacion': 'Anulaciones',
-        'ley 25413': 'Impuestos y percepciones',
-        'ing. bruto': 'Impuestos y percepciones',
-        'ingresos brutos': 'Impuestos y percepciones'
-    }
-    
-    # Temporary differences keywords (adjust without accounting entries)
-    temporary_keywords = {
-        'acreditacion': 'Acreditaciones en tránsito',
-        'transferencia': 'Transferencias transitorias',
-        'transito': 'Depósitos en tránsito',
-        'tránsito': 'Depósitos en tránsito',
-        'en tránsito': 'Depósitos en tránsito',
-        'en transito': 'Depósitos en tránsito',
-        'prisma': 'Acreditaciones tarjetas',
-        'tarjeta': 'Acreditaciones tarjetas'
-    }
-    
     # Check for permanent differences first
-    for keyword, subcategory in permanent_keywords.items():
-        if keyword in descripcion:
-            return {
-                'category': 'Permanente',
-                'subcategory': subcategory,
-                'requires_accounting_entry': True,
-                'is_temporary': False
-            }
+    match = _PERMANENT_RE.match(descripcion)
+    if match:
+        return _category(_PERMANENT_SUBCATEGORIES[match.lastindex - 1], False)
     
     # Check for temporary differences
-    for keyword, subcategory in temporary_keywords.items():
-        if keyword in descripcion:
-            return {
-                'category': 'Temporal',
-                'subcategory': subcategory,
-                'requires_accounting_entry': False,
-                'is_temporary': True
-            }
+    match = _TEMPORARY_RE.match(descripcion)
+    if match:
+        return _category(_TEMPORARY_SUBCATEGORIES[match.lastindex - 1], True)
     
     # Default categorization based on source
-    if source == 'libro':
-        # Item in books but not in bank = likely deposit in transit
-        return {
-            'category': 'Temporal',
-            'subcategory': 'Depósitos en tránsito',
-            'requires_accounting_entry': False,
-            'is_temporary': True
-        }
+    return _category(*_default_category(source))
+
+
+def _first_keyword(text, regex):
+    """
+    Index of the keyword matched by `regex` for each string, or -1 if none.
+    """
+    hits = text.str.extract(regex).notna().to_numpy()
+    return np.where(hits.any(axis=1), hits.argmax(axis=1), -1)
+
+
+def categorize_series(df, source='extracto'):
+    """
+    Vectorized categorize_difference over a whole DataFrame.
+    Returns a DataFrame aligned with df.index with one column per field:
+    Cat_is_temporary, Cat_subcategory (categorical over ALL_SUBCATEGORIES)
+    and Cat_requires_entry.
+    """
+    if 'Descripcion' in df.columns:
+        descripcion = df['Descripcion']
+    elif 'Concepto' in df.columns:
+        descripcion = df['Concepto']
     else:
-        # Item in bank but not in books = likely omitted entry
-        return {
-            'category': 'Permanente',
-            'subcategory': 'Notas de débito/crédito omitidas',
-            'requires_accounting_entry': True,
-            'is_temporary': False
-        }
+        descripcion = pd.Series('', index=df.index)
+    text = descripcion.astype(str).str.lower()
+
+    perm = _first_keyword(text, _PERMANENT_RE)
+    temp = _first_keyword(text, _TEMPORARY_RE)
+    default_subcategory, default_is_temporary = _default_category(source)
+
+    # Permanent keywords take precedence, then temporary ones, then the default
+    is_perm = perm >= 0
+    is_temp = ~is_perm & (temp >= 0)
+    codes = np.full(len(df), ALL_SUBCATEGORIES.index(default_subcategory), dtype=np.int8)
+    codes[is_perm] = _PERMANENT_CODES[perm[is_perm]]
+    codes[is_temp] = _TEMPORARY_CODES[temp[is_temp]]
+    is_temporary = np.where(is_perm, False, np.where(is_temp, True, default_is_temporary))
+
+    return pd.DataFrame({
+        'Cat_is_temporary': is_temporary,
+        'Cat_subcategory': pd.Categorical.from_codes(codes, dtype=SUBCATEGORY_DTYPE),
+        'Cat_requires_entry': ~is_temporary
+    }, index=df.index)
+
+# Libro columns used by load_data (plus the CUIT column, found by name)
+LIBRO_COLUMNS = {'Fecha Pago ', 'Concepto', 'Ingreso', 'Egreso'}
+
+# Extracto header patterns (searched on the lowercased name) -> canonical name.
+# The first matching pattern wins; the optional accents cover mis-decoded headers.
+EXTRACTO_COLUMN_PATTERNS = [
+    (re.compile(r'cr[eé]?ditos'), 'Creditos'),
+    (re.compile(r'd[eé]?bitos'), 'Debitos'),
+    (re.compile(r'n[uú]mero de comprobante'), 'Numero de Comprobante'),
+    (re.compile(r'fecha'), 'Fecha'),
+    (re.compile(r'descripci'), 'Descripcion'),
+    (re.compile(r'saldo'), 'Saldo'),
+    (re.compile(r'leyenda adicional ?2|cuit'), 'CUIT')
+]
+_EXTRACTO_COLUMN_RE = re.compile('|'.join(pattern.pattern for pattern, _ in EXTRACTO_COLUMN_PATTERNS))
+
+
+def _is_libro_column(col):
+    col_lower = str(col).lower()
+    return col in LIBRO_COLUMNS or 'cuit' in col_lower or 'id. tributario' in col_lower
+
+
+def _is_extracto_column(col):
+    return _EXTRACTO_COLUMN_RE.search(str(col).lower()) is not None
+
+
+def read_libro(libro_file):
+    """
+    Reads the raw Libro sheet (headers are on the second row).
+    Only the columns load_data uses are parsed.
+    """
+    return pd.read_excel(libro_file, header=1, engine='calamine', usecols=_is_libro_column)
+
+
+def read_extracto(extracto_file):
+    """
+    Reads the raw bank statement sheet.
+    Only the columns load_data renames are parsed.
+    """
+    return pd.read_excel(extracto_file, engine='calamine', usecols=_is_extracto_column)
+
 
 def load_data(libro_file, extracto_file):
     """
     Loads and pre-processes the two excel files.
+    Each argument can be a file-like object or a DataFrame already parsed with
+    read_libro / read_extracto, so callers can reuse a cached parse.
     """
     # --- Load Libro ---
-    df_libro = pd.read_excel(libro_file, header=1)
+    if isinstance(libro_file, pd.DataFrame):
+        df_libro = libro_file.copy()
+    else:
+        df_libro = read_libro(libro_file)
     
     # Clean amounts - handle both Ingreso and Egreso
-    df_libro['Ingreso_Clean'] = df_libro['Ingreso'].apply(clean_amount)
-    df_libro['Egreso_Clean'] = df_libro['Egreso'].apply(clean_amount)
+    df_libro['Ingreso_Clean'] = clean_amount_series(df_libro['Ingreso'])
+    df_libro['Egreso_Clean'] = clean_amount_series(df_libro['Egreso'])
     
     # Net amount: Ingreso is positive, Egreso is negative
     df_libro['Monto_Libro'] = df_libro['Ingreso_Clean'] - df_libro['Egreso_Clean']
     
-    df_libro['Fecha Pago '] = pd.to_datetime(df_libro['Fecha Pago '], errors='coerce')
+    df_libro['Fecha Pago '] = parse_dates(df_libro['Fecha Pago '])
     
     # --- Load Extracto ---
-    df_extracto = pd.read_excel(extracto_file)
+    if isinstance(extracto_file, pd.DataFrame):
+        df_extracto = extracto_file.copy()
+    else:
+        df_extracto = read_extracto(extracto_file)
     
     # Rename columns to avoid encoding issues
     col_map = {}
 
     for col in df_extracto.columns:
         col_lower = str(col).lower()
-        if 'créditos' in col_lower or 'creditos' in col_lower or 'crditos' in col_lower:
-            col_map[col] = 'Creditos'
-        elif 'débitos' in col_lower or 'debitos' in col_lower or 'dbitos' in col_lower:
-            col_map[col] = 'Debitos'
-        elif 'numero de comprobante' in col_lower or 'número de comprobante' in col_lower:
-            col_map[col] = 'Numero de Comprobante'
-        elif 'fecha' in col_lower and 'Fecha' not in col_map.values(): 
-            col_map[col] = 'Fecha'
-        elif 'descripci' in col_lower:
-            col_map[col] = 'Descripcion'
-        elif 'saldo' in col_lower:
-            col_map[col] = 'Saldo'
-        elif 'leyenda adicional2' in col_lower or 'leyenda adicional 2' in col_lower:
-            col_map[col] = 'CUIT'
-        elif 'cuit' in col_lower: # Fallback if standard name
-            col_map[col] = 'CUIT'
+        for pattern, name in EXTRACTO_COLUMN_PATTERNS:
+            # Only the first date column becomes Fecha, later ones fall through
+            if name == 'Fecha' and 'Fecha' in col_map.values():
+                continue
+            if pattern.search(col_lower):
+                col_map[col] = name
+                break
               
     df_extracto.rename(columns=col_map, inplace=True)
     
     # Clean amounts
     if 'Creditos' in df_extracto.columns:
-        df_extracto['Creditos_Clean'] = df_extracto['Creditos'].apply(clean_amount)
+        df_extracto['Creditos_Clean'] = clean_amount_series(df_extracto['Creditos'])
     else:
         df_extracto['Creditos_Clean'] = 0.0
         
     if 'Debitos' in df_extracto.columns:
-        df_extracto['Debitos_Clean'] = df_extracto['Debitos'].apply(clean_amount)
+        df_extracto['Debitos_Clean'] = clean_amount_series(df_extracto['Debitos'])
     else:
         df_extracto['Debitos_Clean'] = 0.0
     
     # Net amount: Credits are positive, Debits are negative
     df_extracto['Monto_Banco'] = df_extracto['Creditos_Clean'] - df_extracto['Debitos_Clean']
     
-    df_extracto['Fecha'] = pd.to_datetime(df_extracto['Fecha'], errors='coerce')
+    df_extracto['Fecha'] = parse_dates(df_extracto['Fecha'])
 
     # Clean CUIT in Extracto match
     if 'CUIT' in df_extracto.columns:
@@ -212,12 +376,317 @@ def load_data(libro_file, extracto_file):
     
     return df_libro, df_extracto
 
-def process_reconciliation(libro_file, extracto_file):
+
+# --- xlsxwriter format properties ---
+# Plain dicts so they are built once at import; each export binds them to
+# its own workbook with add_format.
+
+# Sheet 1: Conciliacion Bancaria
+
+# Title format (row 0)
+_RECON_TITLE_PROPS = {
+    'bold': True,
+    'font_size': 12,
+    'bg_color': '#4472C4',
+    'font_color': 'white',
+    'align': 'center',
+    'valign': 'vcenter',
+    'border': 1
+}
+
+# Header format (row 1)
+_RECON_HEADER_PROPS = {
+    'bold': True,
+    'font_size': 9,
+    'bg_color': '#4472C4',
+    'font_color': 'white',
+    'align': 'center',
+    'valign': 'vcenter',
+    'border': 1,
+    'text_wrap': True
+}
+
+# Saldo inicial/final (yellow highlight)
+_RECON_SALDO_PROPS = {
+    'bold': True,
+    'font_size': 10,
+    'bg_color': '#FFFF00',
+    'border': 1,
+    'num_format': '$ #,##0.00',
+    'align': 'right'
+}
+
+# Saldo text format
+_RECON_SALDO_TEXT_PROPS = {
+    'bold': True,
+    'font_size': 10,
+    'bg_color': '#FFFF00',
+    'border': 1,
+    'align': 'left'
+}
+
+# Concepto principal (temporal) - green
+_RECON_TEMP_CONCEPT_PROPS = {
+    'bold': True,
+    'bg_color': '#E2EFDA',
+    'border': 1,
+    'font_size': 9,
+    'align': 'left',
+    'valign': 'vcenter'
+}
+
+# Concepto principal (permanente) - orange
+_RECON_PERM_CONCEPT_PROPS = {
+    'bold': True,
+    'bg_color': '#FCE4D6',
+    'border': 1,
+    'font_size': 9,
+    'align': 'left',
+    'valign': 'vcenter'
+}
+
+# Detalle temporal (light green) - money
+_RECON_TEMP_DETAIL_MONEY_PROPS = {
+    'bg_color': '#F4F9F4',
+    'border': 1,
+    'num_format': '$ #,##0.00',
+    'align': 'right',
+    'font_size': 9
+}
+
+# Detalle temporal (light green) - text
+_RECON_TEMP_DETAIL_TEXT_PROPS = {
+    'bg_color': '#F4F9F4',
+    'border': 1,
+    'valign': 'vcenter',
+    'font_size': 9,
+    'text_wrap': True
+}
+
+# Detalle permanente (light orange) - money
+_RECON_PERM_DETAIL_MONEY_PROPS = {
+    'bg_color': '#FFF4ED',
+    'border': 1,
+    'num_format': '$ #,##0.00',
+    'align': 'right',
+    'font_size': 9
+}
+
+# Detalle permanente (light orange) - text
+_RECON_PERM_DETAIL_TEXT_PROPS = {
+    'bg_color': '#FFF4ED',
+    'border': 1,
+    'valign': 'vcenter',
+    'font_size': 9,
+    'text_wrap': True
+}
+
+# Money format with borders
+_RECON_MONEY_PROPS = {
+    'num_format': '$ #,##0.00',
+    'border': 1,
+    'align': 'right'
+}
+
+# Text format with borders
+_RECON_TEXT_PROPS = {
+    'border': 1,
+    'valign': 'vcenter',
+    'text_wrap': True
+}
+
+# Signo format
+_RECON_SIGNO_PROPS = {
+    'bold': True,
+    'align': 'center',
+    'border': 1,
+    'font_size': 11,
+    'valign': 'vcenter'
+}
+
+# Sheet 2: Items Coincidentes
+
+# Header format
+_MATCHED_HEADER_PROPS = {
+    'bold': True,
+    'bg_color': '#4472C4',
+    'font_color': 'white',
+    'border': 1,
+    'align': 'center',
+    'font_size': 9
+}
+
+# Data format
+_MATCHED_DATA_PROPS = {'border': 1, 'font_size': 8}
+
+_MATCHED_MONEY_PROPS = {
+    'border': 1,
+    'num_format': '$ #,##0.00',
+    'font_size': 8
+}
+
+_MATCHED_DATE_PROPS = {
+    'border': 1,
+    'font_size': 8,
+    'num_format': 'DD/MM/YYYY'
+}
+
+# Sheet 3: Diferencias Temporales (green theme)
+
+# Header format (green theme)
+_TEMP_HEADER_PROPS = {
+    'bold': True,
+    'bg_color': '#70AD47',
+    'font_color': 'white',
+    'border': 1,
+    'align': 'center',
+    'font_size': 9
+}
+
+# Data formats
+_TEMP_DATA_PROPS = {
+    'border': 1,
+    'bg_color': '#E2EFDA',
+    'font_size': 8
+}
+
+_TEMP_MONEY_PROPS = {
+    'border': 1,
+    'bg_color': '#E2EFDA',
+    'num_format': '$ #,##0.00',
+    'font_size': 8
+}
+
+_TEMP_DATE_PROPS = {
+    'border': 1,
+    'bg_color': '#E2EFDA',
+    'font_size': 8,
+    'num_format': 'DD/MM/YYYY'
+}
+
+# Sheet 4: Diferencias Permanentes (orange theme)
+
+# Header format (orange theme)
+_PERM_HEADER_PROPS = {
+    'bold': True,
+    'bg_color': '#ED7D31',
+    'font_color': 'white',
+    'border': 1,
+    'align': 'center',
+    'font_size': 9
+}
+
+# Data formats
+_PERM_DATA_PROPS = {
+    'border': 1,
+    'bg_color': '#FCE4D6',
+    'font_size': 8
+}
+
+_PERM_MONEY_PROPS = {
+    'border': 1,
+    'bg_color': '#FCE4D6',
+    'num_format': '$ #,##0.00',
+    'font_size': 8
+}
+
+_PERM_DATE_PROPS = {
+    'border': 1,
+    'bg_color': '#FCE4D6',
+    'font_size': 8,
+    'num_format': 'DD/MM/YYYY'
+}
+
+# Sheet 5: Resumen
+
+# Header format
+_SUMMARY_HEADER_PROPS = {
+    'bold': True,
+    'bg_color': '#5B9BD5',
+    'font_color': 'white',
+    'border': 1,
+    'align': 'center',
+    'font_size': 10
+}
+
+# Data formats
+_SUMMARY_METRIC_PROPS = {
+    'bold': True,
+    'border': 1,
+    'font_size': 9,
+    'bg_color': '#DDEBF7'
+}
+
+_SUMMARY_VALUE_PROPS = {
+    'border': 1,
+    'num_format': '#,##0.00',
+    'font_size': 9,
+    'align': 'right'
+}
+
+_SUMMARY_DESC_PROPS = {
+    'border': 1,
+    'font_size': 9,
+    'font_color': '#666666',
+    'text_wrap': True
+}
+
+# Origen column of the Diferencias Temporales sheet
+ORIGEN_DTYPE = pd.CategoricalDtype(['Libro', 'Extracto'])
+
+# Columns joined onto the matched pairs (the Items Coincidentes sheet)
+MATCHED_LIBRO_COLUMNS = ['Libro_ID', 'Fecha Pago ', 'Concepto', 'Monto_Libro']
+MATCHED_EXTRACTO_COLUMNS = ['Banco_ID', 'Fecha', 'Descripcion', 'Monto_Banco']
+
+# Reconciliation sheet columns holding amounts (G, I, J, K)
+MONEY_COLUMNS = (6, 8, 9, 10)
+
+
+def _write_row_runs(worksheet, row_num, values, formats):
     """
-    Main processing function for bank reconciliation.
+    Writes a row with one write_row call per run of adjacent cells sharing a format.
+    """
+    start = 0
+    for col in range(1, len(values) + 1):
+        if col == len(values) or formats[col] is not formats[start]:
+            worksheet.write_row(row_num, start, values[start:col], formats[start])
+            start = col
+
+
+def _autofit_columns(worksheet, df, fixed_widths, max_width):
+    """
+    Sizes each column to its longest value (or header) plus 2, capped at max_width.
+    Columns in fixed_widths get that width and date columns get 12.
+    Adjacent columns with the same width share one set_column call.
+    """
+    widths = []
+    for col in df.columns:
+        if col in fixed_widths:
+            widths.append(fixed_widths[col])
+        elif 'Fecha' in col:
+            widths.append(12)
+        else:
+            longest = df[col].astype('string').str.len().max()
+            widths.append(min(max(0 if pd.isna(longest) else int(longest), len(str(col))) + 2, max_width))
+    
+    start = 0
+    for col in range(1, len(widths) + 1):
+        if col == len(widths) or widths[col] != widths[start]:
+            worksheet.set_column(start, col - 1, widths[start])
+            start = col
+
+
+def build_reconciliation(libro_file, extracto_file):
+    """
+    Matches Libro against Extracto and builds the reconciliation statement,
+    without touching Excel.
+    Args:
+        libro_file, extracto_file: Excel file-likes or pre-parsed DataFrames.
     Returns:
-        output_file (BytesIO): The Excel file content.
+        reconciliation_rows (list): (kind, cells) rows of the statement sheet.
         summary (dict): Stats and explanation for the UI.
+        sheets (dict): DataFrames for the detail sheets (matched, temp_libro,
+            temp_extracto, perm_extracto).
     """
     df_libro, df_extracto = load_data(libro_file, extracto_file)
     
@@ -227,44 +696,50 @@ def process_reconciliation(libro_file, extracto_file):
     
 
     # --- Step 1: Matching by Check Numbers (Exact) ---
-    df_libro['Cheques_Extraidos'] = df_libro['Concepto'].apply(extract_check_numbers)
-    df_exploded = df_libro.explode('Cheques_Extraidos')
-    df_exploded['check_match_id'] = df_exploded['Cheques_Extraidos'].astype(str).str.strip()
-    df_extracto['check_match_id'] = df_extracto['Numero de Comprobante'].astype(str).str.strip()
+    # Conceptos repeat a lot, so the regex runs once per distinct text
+    cheques_by_concepto = {c: extract_check_numbers(c) for c in df_libro['Concepto'].unique()}
+    df_libro['Cheques_Extraidos'] = df_libro['Concepto'].map(cheques_by_concepto)
+    # Nullable string dtype: missing or blank comprobantes stay <NA> instead of 'nan'/''
+    df_extracto['check_match_id'] = df_extracto['Numero de Comprobante'].astype('string').str.strip().replace('', pd.NA)
     
     matches_data = [] # To store match details
     libro_matched_ids = set()
     banco_matched_ids = set()
     
-    # Filter valid checks (>3 chars) to avoid noise
-    valid_checks_L = df_exploded[df_exploded['check_match_id'].str.len() > 3]
-    valid_checks_B = df_extracto[df_extracto['check_match_id'].str.len() > 3]
+    # Index bank rows by check number (valid checks >3 chars to avoid noise)
+    checks_B = df_extracto['check_match_id'].dropna()
+    checks_B = checks_B[checks_B.str.len() > 3]
+    banco_ids_by_check = {}
+    for b_id, check in checks_B.items():
+        banco_ids_by_check.setdefault(check, []).append(b_id)
     
-    check_matches_df = pd.merge(valid_checks_L, valid_checks_B, on='check_match_id', suffixes=('_L', '_B'))
-    
-    for _, row in check_matches_df.iterrows():
-        l_id = row['Libro_ID']
-        b_id = row['Banco_ID']
-        if l_id not in libro_matched_ids and b_id not in banco_matched_ids:
-            libro_matched_ids.add(l_id)
-            banco_matched_ids.add(b_id)
-            matches_data.append({
-                'Libro_ID': l_id,
-                'Banco_ID': b_id,
-                'Method': 'Cheque',
-                'check_match_id': row['check_match_id']
-            })
+    # Walk the Libro checks in order and claim the first free bank row for each
+    for l_id, cheques in zip(df_libro['Libro_ID'], df_libro['Cheques_Extraidos']):
+        for check in cheques:
+            if len(check) <= 3:
+                continue
+            for b_id in banco_ids_by_check.get(check, ()):
+                if l_id not in libro_matched_ids and b_id not in banco_matched_ids:
+                    libro_matched_ids.add(l_id)
+                    banco_matched_ids.add(b_id)
+                    matches_data.append({
+                        'Libro_ID': l_id,
+                        'Banco_ID': b_id,
+                        'Method': 'Cheque',
+                        'check_match_id': check
+                    })
 
     # --- Helper to get unmatched rows ---
-    def get_unmatched(df, id_col, matched_set):
-        return df[~df[id_col].isin(matched_set)].copy()
+    # Libro_ID / Banco_ID are the frame index, so the anti-join is an index difference
+    def get_unmatched(df, matched_set):
+        return df.loc[df.index.difference(pd.Index(list(matched_set)))].copy()
 
     # --- Step 2 & 3: Fuzzy Matching (CUIT / Date) ---
     # Loop through remaining Libro items
-    candidates_L = get_unmatched(df_libro, 'Libro_ID', libro_matched_ids)
+    candidates_L = get_unmatched(df_libro, libro_matched_ids)
     
     # Pre-filter Extracto to avoid repeated filtering inside loop (optimization)
-    all_candidates_B = get_unmatched(df_extracto, 'Banco_ID', banco_matched_ids)
+    all_candidates_B = get_unmatched(df_extracto, banco_matched_ids)
     
     # We iterate over a copy to avoid index issues
     for _, row_L in candidates_L.iterrows():
@@ -333,38 +808,35 @@ def process_reconciliation(libro_file, extracto_file):
     # --- Reconstruct Results ---
     
     # 1. Merged DataFrame (Matched Items)
+    # Only the columns shown on the Items Coincidentes sheet are joined in
+    libro_cols = [c for c in MATCHED_LIBRO_COLUMNS if c in df_libro.columns]
+    extracto_cols = [c for c in MATCHED_EXTRACTO_COLUMNS if c in df_extracto.columns]
     if matches_data:
         df_matches = pd.DataFrame(matches_data)
         # Javascript-like merge: join metadata
-        merged = pd.merge(df_matches, df_libro, on='Libro_ID')
-        # check_match_id conflict resolution
-        merged = pd.merge(merged, df_extracto, on='Banco_ID', suffixes=('_L', '_B'))
-        
-        # Restore check_match_id from Left (Matches) as main column
-        if 'check_match_id_L' in merged.columns:
-            merged.rename(columns={'check_match_id_L': 'check_match_id'}, inplace=True)
-            
+        merged = pd.merge(df_matches, df_libro[libro_cols], on='Libro_ID')
+        merged = pd.merge(merged, df_extracto[extracto_cols], on='Banco_ID')
         merged['Matched'] = True
     else:
         # Empty schema
-        merged = pd.DataFrame(columns=['Libro_ID', 'Banco_ID', 'Matched', 'check_match_id', 'Method'] + list(df_libro.columns) + list(df_extracto.columns))
+        merged = pd.DataFrame(columns=['Libro_ID', 'Banco_ID', 'Matched', 'check_match_id', 'Method'] + libro_cols[1:] + extracto_cols[1:])
     
     # 2. Unmatched DataFrames
-    extracto_unmatched = get_unmatched(df_extracto, 'Banco_ID', banco_matched_ids)
-    extracto_unmatched['Categoria'] = extracto_unmatched.apply(
-        lambda row: categorize_difference(row, source='extracto'), axis=1
-    )
+    extracto_unmatched = get_unmatched(df_extracto, banco_matched_ids)
+    extracto_unmatched[CATEGORY_COLUMNS] = categorize_series(extracto_unmatched, source='extracto')
     
-    libro_unmatched = get_unmatched(df_libro, 'Libro_ID', libro_matched_ids)
-    libro_unmatched['Categoria'] = libro_unmatched.apply(
-        lambda row: categorize_difference(row, source='libro'), axis=1
-    )
+    libro_unmatched = get_unmatched(df_libro, libro_matched_ids)
+    libro_unmatched[CATEGORY_COLUMNS] = categorize_series(libro_unmatched, source='libro')
+    
+    # Temporary/permanent masks, computed once and reused below
+    ext_temp_mask = extracto_unmatched['Cat_is_temporary'].to_numpy()
+    lib_temp_mask = libro_unmatched['Cat_is_temporary'].to_numpy()
 
     
     # --- Get bank ending balance (last saldo in extracto) ---
     if 'Saldo' in df_extracto.columns:
         # Clean saldo
-        df_extracto['Saldo_Clean'] = df_extracto['Saldo'].apply(clean_amount)
+        df_extracto['Saldo_Clean'] = clean_amount_series(df_extracto['Saldo'])
         saldo_final_banco = df_extracto['Saldo_Clean'].iloc[-1]
     else:
         # Calculate from movements
@@ -386,334 +858,234 @@ def process_reconciliation(libro_file, extracto_file):
     # Col 9: Monto
     # Col 10: Saldo Acumulado
     
+    # Each row is (kind, cells); the kind picks its formatting when exporting:
+    # title, header, saldo, temp_concept, perm_concept, detail or default
     reconciliation_rows = []
-    running_balance = saldo_final_banco
+    # Saldo Acumulado cells are left as None and filled from one cumsum over
+    # balance_deltas (how much each row moves the balance) once all rows exist
+    balance_deltas = []
+    
+    def add_row(kind, cells, delta=0.0):
+        reconciliation_rows.append((kind, cells))
+        balance_deltas.append(delta)
     
     # Row 0: Title
-    reconciliation_rows.append([
+    add_row('title', [
         '', '', f'Conciliación Bancaria - {df_libro["Fecha Pago "].dt.strftime("%B %Y").iloc[0] if len(df_libro) > 0 else ""}',
         '', '', '', '', '', '', '', '', '', ''
     ])
     
     # Row 1: Column headers
-    reconciliation_rows.append([
+    add_row('header', [
         '', '', '', '', '', 'CONCEPTO', 'Se ajusta sin asiento contable', 'CONCEPTO', 
-        'Se ajusta con asiento contable', '', running_balance, '', ''
+        'Se ajusta con asiento contable', '', None, '', ''
     ])
     
     # Row 2: Starting balance
-    reconciliation_rows.append([
-        '', '', 'Saldo final Banco', '', '', '', '', '', '', '', running_balance, '', ''
+    add_row('saldo', [
+        '', '', 'Saldo final Banco', '', '', '', '', '', '', '', None, '', ''
     ])
     
     # --- TEMPORAL DIFFERENCES (Sin asiento contable) ---
     
     # 1. Deposits in transit
     depositos_transito = libro_unmatched[
-        libro_unmatched['Categoria'].apply(lambda x: x.get('is_temporary', False) and x.get('subcategory') == 'Depósitos en tránsito')
+        lib_temp_mask & (libro_unmatched['Cat_subcategory'] == 'Depósitos en tránsito')
     ]
     
     if len(depositos_transito) > 0:
-        reconciliation_rows.append([
+        add_row('temp_concept', [
             '', '+', 'Depósitos en tránsito', '', '', '', '', '', '', '', '', '', ''
         ])
-        for _, row in depositos_transito.iterrows():
-            monto = row['Monto_Libro']
-            running_balance += monto
-            concepto_corto = row['Concepto'][:80] if len(row['Concepto']) > 80 else row['Concepto']
-            reconciliation_rows.append([
-                '', '', '', '', '', concepto_corto, monto, '', '', monto, running_balance, '', ''
-            ])
+        for concepto, monto in depositos_transito[['Concepto', 'Monto_Libro']].itertuples(index=False, name=None):
+            concepto_corto = concepto[:80]
+            add_row('detail', [
+                '', '', '', '', '', concepto_corto, monto, '', '', monto, None, '', ''
+            ], monto)
     
     # 2. Other temporary differences from libro
     otras_temp_libro = libro_unmatched[
-        libro_unmatched['Categoria'].apply(lambda x: x.get('is_temporary', False) and x.get('subcategory') != 'Depósitos en tránsito')
+        lib_temp_mask & (libro_unmatched['Cat_subcategory'] != 'Depósitos en tránsito')
     ]
     
     if len(otras_temp_libro) > 0:
         # Group by subcategory
-        for subcategory, group in otras_temp_libro.groupby(
-            otras_temp_libro['Categoria'].apply(lambda x: x.get('subcategory', 'Otros'))
-        ):
-            reconciliation_rows.append([
+        for subcategory, group in otras_temp_libro.groupby('Cat_subcategory', observed=True):
+            add_row('temp_concept', [
                 '', '+', subcategory, '', '', '', '', '', '', '', '', '', ''
             ])
-            for _, row in group.iterrows():
-                monto = row['Monto_Libro']
-                running_balance += monto
-                concepto_corto = row['Concepto'][:80] if len(row['Concepto']) > 80 else row['Concepto']
-                reconciliation_rows.append([
-                    '', '', '', '', '', concepto_corto, monto, '', '', monto, running_balance, '', ''
-                ])
+            for concepto, monto in group[['Concepto', 'Monto_Libro']].itertuples(index=False, name=None):
+                concepto_corto = concepto[:80]
+                add_row('detail', [
+                    '', '', '', '', '', concepto_corto, monto, '', '', monto, None, '', ''
+                ], monto)
     
     # 3. Temporary differences from extracto (credits in transit)
-    temp_extracto = extracto_unmatched[
-        extracto_unmatched['Categoria'].apply(lambda x: x.get('is_temporary', False))
-    ]
+    temp_extracto = extracto_unmatched[ext_temp_mask]
     
     if len(temp_extracto) > 0:
         # Group by subcategory
-        for subcategory, group in temp_extracto.groupby(
-            temp_extracto['Categoria'].apply(lambda x: x.get('subcategory', 'Otros'))
-        ):
-            reconciliation_rows.append([
+        for subcategory, group in temp_extracto.groupby('Cat_subcategory', observed=True):
+            add_row('temp_concept', [
                 '', '+', subcategory, '', '', '', '', '', '', '', '', '', ''
             ])
-            for _, row in group.iterrows():
-                monto = row['Monto_Banco']
-                running_balance += monto
-                desc_corto = row.get('Descripcion', '')[:80]
-                reconciliation_rows.append([
-                    '', '', '', '', '', desc_corto, monto if monto > 0 else '', '', monto if monto < 0 else '', monto, running_balance, '', ''
-                ])
+            for descripcion, monto in group[['Descripcion', 'Monto_Banco']].itertuples(index=False, name=None):
+                desc_corto = descripcion[:80]
+                add_row('detail', [
+                    '', '', '', '', '', desc_corto, monto if monto > 0 else '', '', monto if monto < 0 else '', monto, None, '', ''
+                ], monto)
     
     # --- PERMANENT DIFFERENCES (Con asiento contable) ---
     
     # 4. Credits not recorded (from extracto) - Notas de crédito omitidas
     creditos_no_registrados = extracto_unmatched[
-        (extracto_unmatched['Categoria'].apply(lambda x: not x.get('is_temporary', True))) &
+        (~ext_temp_mask) &
         (extracto_unmatched['Monto_Banco'] > 0)
     ]
     
     if len(creditos_no_registrados) > 0:
-        reconciliation_rows.append([
+        add_row('perm_concept', [
             '', '+', 'Notas de crédito omitidas por la empresa', '', '', '', '', '', '', '', '', '', ''
         ])
         
         # Group by subcategory
-        for subcategory, group in creditos_no_registrados.groupby(
-            creditos_no_registrados['Categoria'].apply(lambda x: x.get('subcategory', 'Otros'))
-        ):
-            for _, row in group.iterrows():
-                monto = row['Monto_Banco']
-                running_balance += monto
-                desc_corto = row.get('Descripcion', '')[:80]
-                reconciliation_rows.append([
-                    '', '', '', '', '', desc_corto, '', '', monto, monto, running_balance, '', ''
-                ])
+        for subcategory, group in creditos_no_registrados.groupby('Cat_subcategory', observed=True):
+            for descripcion, monto in group[['Descripcion', 'Monto_Banco']].itertuples(index=False, name=None):
+                desc_corto = descripcion[:80]
+                add_row('detail', [
+                    '', '', '', '', '', desc_corto, '', '', monto, monto, None, '', ''
+                ], monto)
     
     # 5. Debits not recorded (from extracto) - Notas de débito omitidas
     debitos_no_registrados = extracto_unmatched[
-        (extracto_unmatched['Categoria'].apply(lambda x: not x.get('is_temporary', True))) &
+        (~ext_temp_mask) &
         (extracto_unmatched['Monto_Banco'] < 0)
     ]
     
     if len(debitos_no_registrados) > 0:
-        reconciliation_rows.append([
+        add_row('perm_concept', [
             '', '+', 'Notas de débito omitidas por la empresa', '', '', '', '', '', '', '', '', '', ''
         ])
         
         # Group by subcategory and aggregate
-        for subcategory, group in debitos_no_registrados.groupby(
-            debitos_no_registrados['Categoria'].apply(lambda x: x.get('subcategory', 'Otros'))
-        ):
+        for subcategory, group in debitos_no_registrados.groupby('Cat_subcategory', observed=True):
             total_grupo = group['Monto_Banco'].sum()
-            running_balance += total_grupo
             
-            reconciliation_rows.append([
-                '', '', '', '', '', subcategory, '', '', total_grupo, total_grupo, running_balance, '', ''
-            ])
+            add_row('detail', [
+                '', '', '', '', '', subcategory, '', '', total_grupo, total_grupo, None, '', ''
+            ], total_grupo)
     
     # 6. Cheques pendientes / registrados de más
-    reconciliation_rows.append([
-        '', '+', 'Cheques omitidos o registrados de menos', '', '', '', '', '', '', 0.00, running_balance, '', ''
+    add_row('perm_concept', [
+        '', '+', 'Cheques omitidos o registrados de menos', '', '', '', '', '', '', 0.00, None, '', ''
     ])
     
-    reconciliation_rows.append([
-        '', '+', 'Depósitos registrados de más', '', '', '', '', '', '', 0.00, running_balance, '', ''
+    add_row('temp_concept', [
+        '', '+', 'Depósitos registrados de más', '', '', '', '', '', '', 0.00, None, '', ''
     ])
     
-    reconciliation_rows.append([
+    add_row('perm_concept', [
         '', '-', 'Cheques pendientes', '', '', '', '', '', '', '', '', '', ''
     ])
     
     # Find pending cheques (in extracto but not matched)
-    cheques_pendientes = extracto_unmatched[
-        (extracto_unmatched['check_match_id'].notna()) & 
-        (extracto_unmatched['check_match_id'] != '') &
-        (extracto_unmatched['check_match_id'] != 'nan') &
-        (extracto_unmatched['Monto_Banco'] < 0)
-    ]
-    
-    if len(cheques_pendientes) > 0:
-        for _, row in cheques_pendientes.iterrows():
-            monto = abs(row['Monto_Banco'])
-            running_balance -= monto
-            desc = f"Cheque {row['check_match_id']}"
-            reconciliation_rows.append([
-                '', '', '', '', '', desc, monto, '', '', monto, running_balance, '', ''
-            ])
+    if len(extracto_unmatched) > 0:
+        cheques_pendientes = extracto_unmatched[
+            (extracto_unmatched['Monto_Banco'] < 0) &
+            extracto_unmatched['check_match_id'].notna()
+        ]
+        for check_id, monto_banco in cheques_pendientes[['check_match_id', 'Monto_Banco']].itertuples(index=False, name=None):
+            monto = abs(monto_banco)
+            desc = f"Cheque {check_id}"
+            add_row('detail', [
+                '', '', '', '', '', desc, monto, '', '', monto, None, '', ''
+            ], -monto)
     
-    reconciliation_rows.append([
-        '', '-', 'Cheques registrados de más', '', '', '', '', '', '', 0.00, running_balance, '', ''
+    add_row('perm_concept', [
+        '', '-', 'Cheques registrados de más', '', '', '', '', '', '', 0.00, None, '', ''
     ])
     
     # --- SALDO DESTINO: Saldo Inicial del Libro Banco ---
-    reconciliation_rows.append([
-        '', '', 'Saldo inicial Libro Banco', '', '', '', '', '', '', '', running_balance, '', ''
+    add_row('default', [
+        '', '', 'Saldo inicial Libro Banco', '', '', '', '', '', '', '', None, '', ''
     ])
     
+    # --- Fill Saldo Acumulado ---
+    # Starting from saldo_final_banco keeps the same left-to-right additions
+    saldos = np.cumsum(np.asarray([saldo_final_banco] + balance_deltas, dtype='float64'))[1:].tolist()
+    for (_, cells), saldo in zip(reconciliation_rows, saldos):
+        if cells[10] is None:
+            cells[10] = saldo
+    
     # --- Calculate summary ---
-    matched_count = int(len(merged[merged['Matched']])) if 'Matched' in merged.columns and not merged.empty else 0
-    temporal_diff = extracto_unmatched[extracto_unmatched['Categoria'].apply(lambda x: x.get('is_temporary', False))]['Monto_Banco'].sum() + \
-                    libro_unmatched[libro_unmatched['Categoria'].apply(lambda x: x.get('is_temporary', False))]['Monto_Libro'].sum()
-    permanente_diff = extracto_unmatched[extracto_unmatched['Categoria'].apply(lambda x: not x.get('is_temporary', True))]['Monto_Banco'].sum()
+    # One mask / one count pass over merged, reused by the summary and the detail sheets
+    matched_mask = merged['Matched'].to_numpy(dtype=bool)
+    matched_count = int(matched_mask.sum())
+    method_counts = merged['Method'].value_counts()
+    temporal_diff = extracto_unmatched.loc[ext_temp_mask, 'Monto_Banco'].sum() + \
+                    libro_unmatched.loc[lib_temp_mask, 'Monto_Libro'].sum()
+    permanente_diff = extracto_unmatched.loc[~ext_temp_mask, 'Monto_Banco'].sum()
     
     summary = {
         "saldo_final_banco": saldo_final_banco,
         "saldo_final_libro": saldo_final_libro,
         "diferencia_total": saldo_final_libro - saldo_final_banco,
         "items_coinciden": matched_count,
-        "matches_cheque": len(merged[merged['Method'] == 'Cheque']) if not merged.empty and 'Method' in merged.columns else 0,
-        "matches_cuit": len(merged[merged['Method'] == 'Monto+CUIT+Fecha']) if not merged.empty and 'Method' in merged.columns else 0,
-        "matches_fuzzy": len(merged[merged['Method'] == 'Monto+Fecha']) if not merged.empty and 'Method' in merged.columns else 0,
-        "diferencias_temporales_count": len(libro_unmatched[libro_unmatched['Categoria'].apply(lambda x: x.get('is_temporary', False))]) + 
-                                       len(extracto_unmatched[extracto_unmatched['Categoria'].apply(lambda x: x.get('is_temporary', False))]),
-        "diferencias_permanentes_count": len(extracto_unmatched[extracto_unmatched['Categoria'].apply(lambda x: not x.get('is_temporary', True))]),
+        "matches_cheque": int(method_counts.get('Cheque', 0)),
+        "matches_cuit": int(method_counts.get('Monto+CUIT+Fecha', 0)),
+        "matches_fuzzy": int(method_counts.get('Monto+Fecha', 0)),
+        "diferencias_temporales_count": int(lib_temp_mask.sum() + ext_temp_mask.sum()),
+        "diferencias_permanentes_count": int((~ext_temp_mask).sum()),
         "diferencias_temporales_monto": temporal_diff,
         "diferencias_permanentes_monto": permanente_diff
     }
     
+    # --- Detail sheets ---
+    sheets = {
+        'matched': merged[matched_mask],
+        'temp_libro': libro_unmatched[lib_temp_mask],
+        'temp_extracto': extracto_unmatched[ext_temp_mask],
+        'perm_extracto': extracto_unmatched[~ext_temp_mask]
+    }
     
-    # --- Export to Excel ---
-    output = io.BytesIO()
-    with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
+    return reconciliation_rows, summary, sheets
+
+
+def write_reconciliation_excel(reconciliation_rows, summary, sheets, output_path=None, max_matched_rows=None):
+    """
+    Writes the output of build_reconciliation to an xlsx workbook.
+    Args:
+        output_path: Optional file path. When given the workbook is written
+            straight to disk instead of being assembled in memory.
+        max_matched_rows: Optional cap on the Items Coincidentes rows (the
+            largest sheet). None writes them all.
+    Returns:
+        output_file (BytesIO): The Excel file content, or output_path if set.
+    """
+    output = io.BytesIO() if output_path is None else output_path
+    # constant_memory streams each row to disk once the next one starts, so
+    # every sheet below is written strictly top to bottom (no to_excel pass)
+    with pd.ExcelWriter(output, engine='xlsxwriter', engine_kwargs={'options': {'constant_memory': True}}) as writer:
         # Sheet 1: Reconciliation Statement (matching schema format)
-        # Create DataFrame from rows with proper column names
-        df_reconciliation = pd.DataFrame(reconciliation_rows, columns=[
-            '', 'Signo', 'Concepto Principal', '', '', 'CONCEPTO', 
-            'Se ajusta sin asiento contable', 'CONCEPTO', 'Se ajusta con asiento contable',
-            'Monto', 'Saldo Acumulado', '', ''
-        ])
-        
-        df_reconciliation.to_excel(writer, sheet_name='Conciliacion Bancaria', index=False, header=False)
-        
-        # Get workbook and worksheet to apply formatting
+        # Every cell is written by the formatting loop below, straight from
+        # reconciliation_rows, so no DataFrame/to_excel pass is needed
         workbook = writer.book
-        worksheet = writer.sheets['Conciliacion Bancaria']
+        worksheet = workbook.add_worksheet('Conciliacion Bancaria')
         
         # === DEFINE FORMATS ===
-        
-        # Title format (row 0)
-        title_format = workbook.add_format({
-            'bold': True,
-            'font_size': 12,
-            'bg_color': '#4472C4',
-            'font_color': 'white',
-            'align': 'center',
-            'valign': 'vcenter',
-            'border': 1
-        })
-        
-        # Header format (row 1)
-        header_format = workbook.add_format({
-            'bold': True,
-            'font_size': 9,
-            'bg_color': '#4472C4',
-            'font_color': 'white',
-            'align': 'center',
-            'valign': 'vcenter',
-            'border': 1,
-            'text_wrap': True
-        })
-        
-        # Saldo inicial/final (yellow highlight)
-        saldo_format = workbook.add_format({
-            'bold': True,
-            'font_size': 10,
-            'bg_color': '#FFFF00',
-            'border': 1,
-            'num_format': '$ #,##0.00',
-            'align': 'right'
-        })
-        
-        # Saldo text format
-        saldo_text_format = workbook.add_format({
-            'bold': True,
-            'font_size': 10,
-            'bg_color': '#FFFF00',
-            'border': 1,
-            'align': 'left'
-        })
-        
-        # Concepto principal (temporal) - green
-        temporal_concept_format = workbook.add_format({
-            'bold': True,
-            'bg_color': '#E2EFDA',
-            'border': 1,
-            'font_size': 9,
-            'align': 'left',
-            'valign': 'vcenter'
-        })
-        
-        # Concepto principal (permanente) - orange
-        permanent_concept_format = workbook.add_format({
-            'bold': True,
-            'bg_color': '#FCE4D6',
-            'border': 1,
-            'font_size': 9,
-            'align': 'left',
-            'valign': 'vcenter'
-        })
-        
-        # Detalle temporal (light green) - money
-        temporal_detail_money = workbook.add_format({
-            'bg_color': '#F4F9F4',
-            'border': 1,
-            'num_format': '$ #,##0.00',
-            'align': 'right',
-            'font_size': 9
-        })
-        
-        # Detalle temporal (light green) - text
-        temporal_detail_text = workbook.add_format({
-            'bg_color': '#F4F9F4',
-            'border': 1,
-            'valign': 'vcenter',
-            'font_size': 9,
-            'text_wrap': True
-        })
-        
-        # Detalle permanente (light orange) - money
-        permanent_detail_money = workbook.add_format({
-            'bg_color': '#FFF4ED',
-            'border': 1,
-            'num_format': '$ #,##0.00',
-            'align': 'right',
-            'font_size': 9
-        })
-        
-        # Detalle permanente (light orange) - text
-        permanent_detail_text = workbook.add_format({
-            'bg_color': '#FFF4ED',
-            'border': 1,
-            'valign': 'vcenter',
-            'font_size': 9,
-            'text_wrap': True
-        })
-        
-        # Money format with borders
-        money_format = workbook.add_format({
-            'num_format': '$ #,##0.00',
-            'border': 1,
-            'align': 'right'
-        })
-        
-        # Text format with borders
-        text_format = workbook.add_format({
-            'border': 1,
-            'valign': 'vcenter',
-            'text_wrap': True
-        })
-        
-        # Signo format
-        signo_format = workbook.add_format({
-            'bold': True,
-            'align': 'center',
-            'border': 1,
-            'font_size': 11,
-            'valign': 'vcenter'
-        })
+        title_format = workbook.add_format(_RECON_TITLE_PROPS)
+        header_format = workbook.add_format(_RECON_HEADER_PROPS)
+        saldo_format = workbook.add_format(_RECON_SALDO_PROPS)
+        saldo_text_format = workbook.add_format(_RECON_SALDO_TEXT_PROPS)
+        temporal_concept_format = workbook.add_format(_RECON_TEMP_CONCEPT_PROPS)
+        permanent_concept_format = workbook.add_format(_RECON_PERM_CONCEPT_PROPS)
+        temporal_detail_money = workbook.add_format(_RECON_TEMP_DETAIL_MONEY_PROPS)
+        temporal_detail_text = workbook.add_format(_RECON_TEMP_DETAIL_TEXT_PROPS)
+        permanent_detail_money = workbook.add_format(_RECON_PERM_DETAIL_MONEY_PROPS)
+        permanent_detail_text = workbook.add_format(_RECON_PERM_DETAIL_TEXT_PROPS)
+        money_format = workbook.add_format(_RECON_MONEY_PROPS)
+        text_format = workbook.add_format(_RECON_TEXT_PROPS)
+        signo_format = workbook.add_format(_RECON_SIGNO_PROPS)
         
         # === APPLY COLUMN WIDTHS ===
         worksheet.set_column('A:A', 1.5)
@@ -728,109 +1100,62 @@ def process_reconciliation(libro_file, extracto_file):
         worksheet.set_column('K:K', 17)
         
         # === APPLY FORMATTING ROW BY ROW ===
-        for row_num, row_data in enumerate(reconciliation_rows):
+        # kind -> (row height, text format, money format, format for empty money cells)
+        row_formats = {
+            'saldo': (22, saldo_text_format, saldo_format, saldo_format),
+            'temp_concept': (20, temporal_concept_format, money_format, temporal_concept_format),
+            'perm_concept': (20, permanent_concept_format, money_format, permanent_concept_format),
+            'default': (15, text_format, money_format, text_format)
+        }
+        
+        for row_num, (kind, row_data) in enumerate(reconciliation_rows):
             signo = row_data[1]
-            concepto_principal = row_data[2]
             
-            # Row 0: Title
-            if row_num == 0:
-                worksheet.set_row(row_num, 25)
-                for col in range(13):
-                    worksheet.write(row_num, col, row_data[col] if row_data[col] else '', title_format)
+            # Title / Headers (one format for the whole row)
+            if kind in ('title', 'header'):
+                worksheet.set_row(row_num, 25 if kind == 'title' else 35)
+                worksheet.write_row(
+                    row_num, 0, [val if val else '' for val in row_data],
+                    title_format if kind == 'title' else header_format
+                )
+                continue
             
-            # Row 1: Headers
-            elif row_num == 1:
-                worksheet.set_row(row_num, 35)
-                for col in range(13):
-                    worksheet.write(row_num, col, row_data[col] if row_data[col] else '', header_format)
+            # Detail rows with no text in column F are laid out like default rows
+            if kind == 'detail' and not row_data[5]:
+                kind = 'default'
             
-            # Saldo inicial/final
-            elif concepto_principal and ('Saldo final' in str(concepto_principal)):
-                worksheet.set_row(row_num, 22)
-                for col in range(13):
-                    val = row_data[col] if row_data[col] != '' else ''
-                    if col == 2:  # Concepto
-                        worksheet.write(row_num, col, val, saldo_text_format)
-                    elif col in [6, 8, 9, 10]:  # Money columns
-                        if val != '' and val != 0:
-                            worksheet.write(row_num, col, val, saldo_format)
-                        else:
-                            worksheet.write(row_num, col, '', saldo_format)
-                    else:
-                        worksheet.write(row_num, col, val, saldo_text_format)
-            
-            # Temporal concepts (with +/- sign)
-            elif signo and concepto_principal and any(term in str(concepto_principal) for term in 
-                ['Depósito', 'tránsito', 'Acredita', 'Transferencia', 'tarjeta']):
-                worksheet.set_row(row_num, 20)
-                worksheet.write(row_num, 1, signo, signo_format)
-                worksheet.write(row_num, 2, concepto_principal, temporal_concept_format)
-                for col in [0, 3, 4, 5, 6, 7, 8, 9, 10, 11, 12]:
-                    val = row_data[col] if row_data[col] != '' else ''
-                    if col in [6, 8, 9, 10]:
-                        if val != '' and val != 0:
-                            worksheet.write(row_num, col, val, money_format)
-                        else:
-                            worksheet.write(row_num, col, '', temporal_concept_format)
-                    else:
-                        worksheet.write(row_num, col, val, temporal_concept_format)
-            
-            # Permanent concepts (with +/- sign)
-            elif signo and concepto_principal and any(term in str(concepto_principal) for term in 
-                ['Notas de', 'Cheques', 'omitido', 'registrado', 'pendiente']):
-                worksheet.set_row(row_num, 20)
-                worksheet.write(row_num, 1, signo, signo_format)
-                worksheet.write(row_num, 2, concepto_principal, permanent_concept_format)
-                for col in [0, 3, 4, 5, 6, 7, 8, 9, 10, 11, 12]:
-                    val = row_data[col] if row_data[col] != '' else ''
-                    if col in [6, 8, 9, 10]:
-                        if val != '' and val != 0:
-                            worksheet.write(row_num, col, val, money_format)
-                        else:
-                            worksheet.write(row_num, col, '', permanent_concept_format)
-                    else:
-                        worksheet.write(row_num, col, val, permanent_concept_format)
-            
-            # Detail rows (following concepts)
-            elif not signo and not concepto_principal and row_data[5]:  # Has detail in column F
+            if kind == 'detail':
                 # Set row height based on text length
                 text_length = len(str(row_data[5]))
                 if text_length > 100:
-                    worksheet.set_row(row_num, 30)
+                    row_height = 30
                 elif text_length > 60:
-                    worksheet.set_row(row_num, 20)
+                    row_height = 20
                 else:
-                    worksheet.set_row(row_num, 15)
+                    row_height = 15
                 
                 # Determine if temporal or permanent based on which column has value
                 is_temporal = row_data[6] != '' and row_data[6] != 0
                 money_fmt = temporal_detail_money if is_temporal else permanent_detail_money
                 text_fmt = temporal_detail_text if is_temporal else permanent_detail_text
-                
-                for col in range(13):
-                    val = row_data[col]
-                    if col in [6, 8, 9, 10]:  # Money columns
-                        if val != '' and val != 0:
-                            worksheet.write(row_num, col, val, money_fmt)
-                        else:
-                            worksheet.write(row_num, col, '', text_fmt)
-                    else:
-                        worksheet.write(row_num, col, val if val != '' else '', text_fmt)
-            
-            # Default format
+                blank_money_fmt = text_fmt
             else:
-                worksheet.set_row(row_num, 15)
-                for col in range(13):
-                    val = row_data[col] if row_data[col] != '' else ''
-                    if col in [6, 8, 9, 10]:
-                        if val != '' and val != 0:
-                            worksheet.write(row_num, col, val, money_format)
-                        else:
-                            worksheet.write(row_num, col, '', text_format)
-                    elif col == 1:
-                        worksheet.write(row_num, col, val, signo_format if val else text_format)
-                    else:
-                        worksheet.write(row_num, col, val, text_format)
+                row_height, text_fmt, money_fmt, blank_money_fmt = row_formats[kind]
+            
+            worksheet.set_row(row_num, row_height)
+            
+            # Per-cell formats: money columns only get the money format when they
+            # hold a non-zero amount, the sign column gets its own format
+            values = list(row_data)
+            formats = [text_fmt] * len(values)
+            formats[1] = signo_format if signo else text_fmt
+            for col in MONEY_COLUMNS:
+                if values[col] != '' and values[col] != 0:
+                    formats[col] = money_fmt
+                else:
+                    values[col] = ''
+                    formats[col] = blank_money_fmt
+            _write_row_runs(worksheet, row_num, values, formats)
         
         # Freeze panes (freeze first 2 rows)
         worksheet.freeze_panes(2, 0)
@@ -845,230 +1170,146 @@ def process_reconciliation(libro_file, extracto_file):
 
         
         # === SHEET 2: MATCHED ITEMS ===
-        matched_items = merged[merged['Matched']].copy()
+        matched_items = sheets['matched']
+        if max_matched_rows is not None and len(matched_items) > max_matched_rows:
+            warnings.warn(
+                f"Items Coincidentes truncated to {max_matched_rows} of {len(matched_items)} rows"
+            )
+            matched_items = matched_items.head(max_matched_rows)
         if len(matched_items) > 0:
             cols_matched = ['check_match_id', 'Method', 'Fecha Pago ', 'Concepto', 'Monto_Libro', 
                            'Fecha', 'Descripcion', 'Monto_Banco']
             cols_matched = [c for c in cols_matched if c in matched_items.columns]
-            matched_items[cols_matched].to_excel(writer, sheet_name='Items Coincidentes', index=False)
             
             # Format Sheet 2
-            ws_matched = writer.sheets['Items Coincidentes']
+            ws_matched = workbook.add_worksheet('Items Coincidentes')
             
-            # Header format
-            header_fmt = workbook.add_format({
-                'bold': True,
-                'bg_color': '#4472C4',
-                'font_color': 'white',
-                'border': 1,
-                'align': 'center',
-                'font_size': 9
-            })
-            
-            # Data format
-            data_fmt = workbook.add_format({'border': 1, 'font_size': 8})
-            money_fmt_small = workbook.add_format({
-                'border': 1,
-                'num_format': '$ #,##0.00',
-                'font_size': 8
-            })
-            date_fmt_small = workbook.add_format({
-                'border': 1,
-                'font_size': 8,
-                'num_format': 'DD/MM/YYYY'
-            })
+            header_fmt = workbook.add_format(_MATCHED_HEADER_PROPS)
+            data_fmt = workbook.add_format(_MATCHED_DATA_PROPS)
+            money_fmt_small = workbook.add_format(_MATCHED_MONEY_PROPS)
+            date_fmt_small = workbook.add_format(_MATCHED_DATE_PROPS)
             
             # Apply header format
-            for col_num, value in enumerate(matched_items[cols_matched].columns.values):
-                ws_matched.write(0, col_num, value, header_fmt)
+            ws_matched.write_row(0, 0, cols_matched, header_fmt)
             
-            # Auto-fit columns
-            for i, col in enumerate(cols_matched):
-                if 'Fecha' in col:
-                    ws_matched.set_column(i, i, 12)
-                else:
-                    max_len = max(
-                        matched_items[col].astype(str).map(len).max(),
-                        len(str(col))
-                    ) + 2
-                    ws_matched.set_column(i, i, min(max_len, 50))
+            matched_filtered = matched_items[cols_matched]
             
+            # Auto-fit columns
+            _autofit_columns(ws_matched, matched_filtered, {}, 50)
             
             # Apply data format - use filtered dataframe
-            matched_filtered = matched_items[cols_matched]
-            for row in range(1, len(matched_filtered) + 1):
-                for col in range(len(cols_matched)):
-                    val = matched_filtered.iloc[row-1, col]
-                    col_name = cols_matched[col]
-                    # Handle list values (convert to string) - check first to avoid isna errors
+            # One format per column and one NaN mask for the frame, then plain tuples per row
+            col_fmts = [
+                money_fmt_small if 'Monto' in c else date_fmt_small if 'Fecha' in c else data_fmt
+                for c in cols_matched
+            ]
+            missing = matched_filtered.isna().to_numpy()
+            for row, values in enumerate(matched_filtered.itertuples(index=False, name=None)):
+                for col, val in enumerate(values):
+                    # Handle list values (convert to string)
                     if isinstance(val, (list, tuple)):
-                        ws_matched.write(row, col, ', '.join(str(v) for v in val), data_fmt)
+                        ws_matched.write(row + 1, col, ', '.join(str(v) for v in val), data_fmt)
                     # Handle NaN values
-                    elif pd.isna(val):
-                        ws_matched.write(row, col, '', data_fmt)
-                    elif 'Monto' in col_name:
-                        ws_matched.write(row, col, val, money_fmt_small)
-                    elif 'Fecha' in col_name:
-                        ws_matched.write(row, col, val, date_fmt_small)
+                    elif missing[row, col]:
+                        ws_matched.write(row + 1, col, '', data_fmt)
                     else:
-                        ws_matched.write(row, col, val, data_fmt)
+                        ws_matched.write(row + 1, col, val, col_fmts[col])
             
             ws_matched.freeze_panes(1, 0)
             ws_matched.set_zoom(110)
         
         # === SHEET 3: TEMPORARY DIFFERENCES ===
-        temp_libro = libro_unmatched[libro_unmatched['Categoria'].apply(lambda x: x.get('is_temporary', False))].copy()
-        temp_extracto = extracto_unmatched[extracto_unmatched['Categoria'].apply(lambda x: x.get('is_temporary', False))].copy()
+        temp_libro = sheets['temp_libro']
+        temp_extracto = sheets['temp_extracto']
         
         if len(temp_libro) > 0 or len(temp_extracto) > 0:
+            # Each side is built straight under the sheet's column names from
+            # the columns it needs, so there is no full-frame copy or rename
             temp_all = []
             if len(temp_libro) > 0:
-                temp_libro['Origen'] = 'Libro'
-                temp_libro['Subcategoria'] = temp_libro['Categoria'].apply(lambda x: x.get('subcategory', ''))
-                temp_all.append(temp_libro[['Fecha Pago ', 'Concepto', 'Monto_Libro', 'Subcategoria', 'Origen']])
+                temp_all.append(pd.DataFrame({
+                    'Fecha Pago ': temp_libro['Fecha Pago '],
+                    'Concepto': temp_libro['Concepto'],
+                    'Monto_Libro': temp_libro['Monto_Libro'],
+                    'Subcategoria': temp_libro['Cat_subcategory'],
+                    'Origen': pd.Series('Libro', index=temp_libro.index, dtype=ORIGEN_DTYPE)
+                }))
             if len(temp_extracto) > 0:
-                temp_extracto['Origen'] = 'Extracto'
-                temp_extracto['Subcategoria'] = temp_extracto['Categoria'].apply(lambda x: x.get('subcategory', ''))
-                temp_all.append(temp_extracto[['Fecha', 'Descripcion', 'Monto_Banco', 'Subcategoria', 'Origen']].rename(
-                    columns={'Fecha': 'Fecha Pago ', 'Descripcion': 'Concepto', 'Monto_Banco': 'Monto_Libro'}
-                ))
+                temp_all.append(pd.DataFrame({
+                    'Fecha Pago ': temp_extracto['Fecha'],
+                    'Concepto': temp_extracto['Descripcion'],
+                    'Monto_Libro': temp_extracto['Monto_Banco'],
+                    'Subcategoria': temp_extracto['Cat_subcategory'],
+                    'Origen': pd.Series('Extracto', index=temp_extracto.index, dtype=ORIGEN_DTYPE)
+                }))
             
             df_temp = pd.concat(temp_all, ignore_index=True)
-            df_temp.to_excel(writer, sheet_name='Diferencias Temporales', index=False)
             
             # Format Sheet 3
-            ws_temp = writer.sheets['Diferencias Temporales']
-            
-            # Header format (green theme)
-            header_temp_fmt = workbook.add_format({
-                'bold': True,
-                'bg_color': '#70AD47',
-                'font_color': 'white',
-                'border': 1,
-                'align': 'center',
-                'font_size': 9
-            })
+            ws_temp = workbook.add_worksheet('Diferencias Temporales')
             
-            # Data formats
-            data_temp_fmt = workbook.add_format({
-                'border': 1,
-                'bg_color': '#E2EFDA',
-                'font_size': 8
-            })
-            money_temp_fmt = workbook.add_format({
-                'border': 1,
-                'bg_color': '#E2EFDA',
-                'num_format': '$ #,##0.00',
-                'font_size': 8
-            })
-            date_temp_fmt = workbook.add_format({
-                'border': 1,
-                'bg_color': '#E2EFDA',
-                'font_size': 8,
-                'num_format': 'DD/MM/YYYY'
-            })
+            header_temp_fmt = workbook.add_format(_TEMP_HEADER_PROPS)
+            data_temp_fmt = workbook.add_format(_TEMP_DATA_PROPS)
+            money_temp_fmt = workbook.add_format(_TEMP_MONEY_PROPS)
+            date_temp_fmt = workbook.add_format(_TEMP_DATE_PROPS)
             
             # Apply header
-            for col_num, value in enumerate(df_temp.columns.values):
-                ws_temp.write(0, col_num, value, header_temp_fmt)
+            ws_temp.write_row(0, 0, list(df_temp.columns), header_temp_fmt)
             
             # Auto-fit columns
-            for i, col in enumerate(df_temp.columns):
-                if col == 'Concepto':
-                    ws_temp.set_column(i, i, 60)
-                elif col == 'Monto_Libro':
-                    ws_temp.set_column(i, i, 15)
-                elif 'Fecha' in col:
-                    ws_temp.set_column(i, i, 12)
-                else:
-                    max_len = max(df_temp[col].astype(str).map(len).max(), len(str(col))) + 2
-                    ws_temp.set_column(i, i, min(max_len, 25))
+            _autofit_columns(ws_temp, df_temp, {'Concepto': 60, 'Monto_Libro': 15}, 25)
             
             
             # Apply data format
-            for row in range(len(df_temp)):
-                for col, col_name in enumerate(df_temp.columns):
-                    val = df_temp.iloc[row, col]
-                    if pd.isna(val):
+            col_fmts = [
+                money_temp_fmt if c == 'Monto_Libro' else date_temp_fmt if 'Fecha' in c else data_temp_fmt
+                for c in df_temp.columns
+            ]
+            missing = df_temp.isna().to_numpy()
+            for row, values in enumerate(df_temp.itertuples(index=False, name=None)):
+                for col, val in enumerate(values):
+                    if missing[row, col]:
                         ws_temp.write(row + 1, col, '', data_temp_fmt)
-                    elif col_name == 'Monto_Libro':
-                        ws_temp.write(row + 1, col, val, money_temp_fmt)
-                    elif 'Fecha' in col_name:
-                        ws_temp.write(row + 1, col, val, date_temp_fmt)
                     else:
-                        ws_temp.write(row + 1, col, val, data_temp_fmt)
+                        ws_temp.write(row + 1, col, val, col_fmts[col])
             
             ws_temp.freeze_panes(1, 0)
             ws_temp.set_zoom(110)
         
         # === SHEET 4: PERMANENT DIFFERENCES ===
-        perm_extracto = extracto_unmatched[extracto_unmatched['Categoria'].apply(lambda x: not x.get('is_temporary', True))].copy()
+        perm_extracto = sheets['perm_extracto']
         if len(perm_extracto) > 0:
-            perm_extracto['Subcategoria'] = perm_extracto['Categoria'].apply(lambda x: x.get('subcategory', ''))
-            df_perm = perm_extracto[['Fecha', 'Descripcion', 'Monto_Banco', 'Subcategoria']]
-            df_perm.to_excel(writer, sheet_name='Diferencias Permanentes', index=False)
+            df_perm = perm_extracto[['Fecha', 'Descripcion', 'Monto_Banco', 'Cat_subcategory']].rename(
+                columns={'Cat_subcategory': 'Subcategoria'}
+            )
             
             # Format Sheet 4
-            ws_perm = writer.sheets['Diferencias Permanentes']
-            
-            # Header format (orange theme)
-            header_perm_fmt = workbook.add_format({
-                'bold': True,
-                'bg_color': '#ED7D31',
-                'font_color': 'white',
-                'border': 1,
-                'align': 'center',
-                'font_size': 9
-            })
+            ws_perm = workbook.add_worksheet('Diferencias Permanentes')
             
-            # Data formats
-            data_perm_fmt = workbook.add_format({
-                'border': 1,
-                'bg_color': '#FCE4D6',
-                'font_size': 8
-            })
-            money_perm_fmt = workbook.add_format({
-                'border': 1,
-                'bg_color': '#FCE4D6',
-                'num_format': '$ #,##0.00',
-                'font_size': 8
-            })
-            date_perm_fmt = workbook.add_format({
-                'border': 1,
-                'bg_color': '#FCE4D6',
-                'font_size': 8,
-                'num_format': 'DD/MM/YYYY'
-            })
+            header_perm_fmt = workbook.add_format(_PERM_HEADER_PROPS)
+            data_perm_fmt = workbook.add_format(_PERM_DATA_PROPS)
+            money_perm_fmt = workbook.add_format(_PERM_MONEY_PROPS)
+            date_perm_fmt = workbook.add_format(_PERM_DATE_PROPS)
             
             # Apply header
-            for col_num, value in enumerate(df_perm.columns.values):
-                ws_perm.write(0, col_num, value, header_perm_fmt)
+            ws_perm.write_row(0, 0, list(df_perm.columns), header_perm_fmt)
             
             # Auto-fit columns
-            for i, col in enumerate(df_perm.columns):
-                if col == 'Descripcion':
-                    ws_perm.set_column(i, i, 60)
-                elif col == 'Monto_Banco':
-                    ws_perm.set_column(i, i, 15)
-                elif col == 'Fecha':
-                    ws_perm.set_column(i, i, 12)
-                else:
-                    max_len = max(df_perm[col].astype(str).map(len).max(), len(str(col))) + 2
-                    ws_perm.set_column(i, i, min(max_len, 25))
+            _autofit_columns(ws_perm, df_perm, {'Descripcion': 60, 'Monto_Banco': 15}, 25)
             
             
             # Apply data format
-            for row in range(len(df_perm)):
-                for col, col_name in enumerate(df_perm.columns):
-                    val = df_perm.iloc[row, col]
-                    if pd.isna(val):
+            col_fmts = [
+                money_perm_fmt if c == 'Monto_Banco' else date_perm_fmt if c == 'Fecha' else data_perm_fmt
+                for c in df_perm.columns
+            ]
+            missing = df_perm.isna().to_numpy()
+            for row, values in enumerate(df_perm.itertuples(index=False, name=None)):
+                for col, val in enumerate(values):
+                    if missing[row, col]:
                         ws_perm.write(row + 1, col, '', data_perm_fmt)
-                    elif col_name == 'Monto_Banco':
-                        ws_perm.write(row + 1, col, val, money_perm_fmt)
-                    elif col_name == 'Fecha':
-                        ws_perm.write(row + 1, col, val, date_perm_fmt)
                     else:
-                        ws_perm.write(row + 1, col, val, data_perm_fmt)
+                        ws_perm.write(row + 1, col, val, col_fmts[col])
             
             ws_perm.freeze_panes(1, 0)
             ws_perm.set_zoom(110)
@@ -1089,48 +1330,16 @@ def process_reconciliation(libro_file, extracto_file):
             "diferencias_permanentes_monto": "Monto total de diferencias permanentes"
         }
         
-        summary_df = pd.DataFrame([summary]).T.reset_index()
-        summary_df.columns = ['Métrica', 'Valor']
-        summary_df['Descripción'] = summary_df['Métrica'].map(descripciones)
-        summary_df.to_excel(writer, sheet_name='Resumen', index=False)
-        
         # Format Sheet 5
-        ws_summary = writer.sheets['Resumen']
+        ws_summary = workbook.add_worksheet('Resumen')
         
-        # Header format
-        header_summary_fmt = workbook.add_format({
-            'bold': True,
-            'bg_color': '#5B9BD5',
-            'font_color': 'white',
-            'border': 1,
-            'align': 'center',
-            'font_size': 10
-        })
-        
-        # Data formats
-        metric_fmt = workbook.add_format({
-            'bold': True,
-            'border': 1,
-            'font_size': 9,
-            'bg_color': '#DDEBF7'
-        })
-        value_fmt = workbook.add_format({
-            'border': 1,
-            'num_format': '#,##0.00',
-            'font_size': 9,
-            'align': 'right'
-        })
-        desc_fmt = workbook.add_format({
-            'border': 1,
-            'font_size': 9,
-            'font_color': '#666666',
-            'text_wrap': True
-        })
+        header_summary_fmt = workbook.add_format(_SUMMARY_HEADER_PROPS)
+        metric_fmt = workbook.add_format(_SUMMARY_METRIC_PROPS)
+        value_fmt = workbook.add_format(_SUMMARY_VALUE_PROPS)
+        desc_fmt = workbook.add_format(_SUMMARY_DESC_PROPS)
         
         # Apply header
-        ws_summary.write(0, 0, 'Métrica', header_summary_fmt)
-        ws_summary.write(0, 1, 'Valor', header_summary_fmt)
-        ws_summary.write(0, 2, 'Descripción', header_summary_fmt)
+        ws_summary.write_row(0, 0, ['Métrica', 'Valor', 'Descripción'], header_summary_fmt)
         
         # Set column widths
         ws_summary.set_column(0, 0, 35)
@@ -1138,14 +1347,35 @@ def process_reconciliation(libro_file, extracto_file):
         ws_summary.set_column(2, 2, 50)
         
         # Apply data format
-        for row in range(len(summary_df)):
-            ws_summary.write(row + 1, 0, summary_df.iloc[row, 0], metric_fmt)
-            ws_summary.write(row + 1, 1, summary_df.iloc[row, 1], value_fmt)
-            ws_summary.write(row + 1, 2, summary_df.iloc[row, 2], desc_fmt)
+        for row, (metrica, valor) in enumerate(summary.items(), start=1):
+            ws_summary.write(row, 0, metrica, metric_fmt)
+            ws_summary.write(row, 1, valor, value_fmt)
+            ws_summary.write(row, 2, descripciones[metrica], desc_fmt)
         
         ws_summary.freeze_panes(1, 0)
         ws_summary.set_zoom(110)
         
+    if output_path is not None:
+        return output_path
+    
     output.seek(0)
     
+    return output
+
+
+def process_reconciliation(libro_file, extracto_file, output_path=None, max_matched_rows=None):
+    """
+    Main processing function for bank reconciliation.
+    Args:
+        libro_file, extracto_file: Excel file-likes or pre-parsed DataFrames.
+        output_path, max_matched_rows: Passed to write_reconciliation_excel.
+    Returns:
+        output_file (BytesIO): The Excel file content, or output_path if set.
+        summary (dict): Stats and explanation for the UI.
+    """
+    reconciliation_rows, summary, sheets = build_reconciliation(libro_file, extracto_file)
+    output = write_reconciliation_excel(
+        reconciliation_rows, summary, sheets,
+        output_path=output_path, max_matched_rows=max_matched_rows
+    )
     return output, summary
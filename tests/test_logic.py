@@ -0,0 +1,108 @@
+import numpy as np
+import pandas as pd
+
+from logic import (
+    PERMANENT_KEYWORDS,
+    TEMPORARY_KEYWORDS,
+    build_reconciliation,
+    categorize_difference,
+    categorize_series,
+    clean_amount,
+    clean_amount_series,
+    parse_dates,
+)
+
+
+def test_parse_dates_iso_and_day_first_in_same_column():
+    s = pd.Series(['2024-03-05', '05/03/2024', '2024-12-01', '01/12/2024', None])
+    parsed = parse_dates(s)
+    assert parsed.tolist()[:4] == [
+        pd.Timestamp('2024-03-05'), pd.Timestamp('2024-03-05'),
+        pd.Timestamp('2024-12-01'), pd.Timestamp('2024-12-01'),
+    ]
+    assert pd.isna(parsed.iloc[4])
+
+
+def test_parse_dates_numeric_columns_are_excel_serials():
+    for s in (pd.Series([45000.0, np.nan]), pd.Series([45000, 45001])):
+        parsed = parse_dates(s)
+        assert pd.api.types.is_datetime64_any_dtype(parsed)
+        assert parsed.iloc[0] == pd.Timestamp('2023-03-15')
+
+
+def test_parse_dates_timezone_suffixes():
+    s = pd.Series(['2024-03-05T10:00:00Z', '05/03/2024', '2024-03-06T10:00:00-03:00', None])
+    parsed = parse_dates(s)
+    assert parsed.tolist()[:3] == [
+        pd.Timestamp('2024-03-05 10:00'), pd.Timestamp('2024-03-05'),
+        pd.Timestamp('2024-03-06 13:00'),
+    ]
+    assert pd.isna(parsed.iloc[3])
+    only_z = parse_dates(pd.Series(['2024-03-05T10:00:00Z', '2024-03-06T10:00:00Z']))
+    assert only_z.tolist() == [pd.Timestamp('2024-03-05 10:00'), pd.Timestamp('2024-03-06 10:00')]
+
+
+def test_parse_dates_mixed_object_column_with_numbers():
+    s = pd.Series(['05/03/2024', 45000, '2024-03-05'], dtype=object)
+    parsed = parse_dates(s)
+    assert parsed.iloc[0] == pd.Timestamp('2024-03-05')
+    assert parsed.iloc[2] == pd.Timestamp('2024-03-05')
+
+
+def test_clean_amount_series_keeps_numpy_scalars_in_object_columns():
+    s = pd.Series([np.float64(1050.5), np.int64(7), 3, '1.050,25', None, 'x'], dtype=object)
+    assert clean_amount_series(s).tolist() == [1050.5, 7.0, 3.0, 1050.25, 0.0, 0.0]
+
+
+def test_clean_amount_series_matches_clean_amount():
+    vals = [
+        '1.234,56\xa0', '  200,00 ', '-1.050,25', '+7', '', '   ', None, np.nan,
+        np.float64(1050.5), np.int64(7), 3, 2.5, 'x',
+    ]
+    expected = [clean_amount(v) for v in vals]
+    assert clean_amount_series(pd.Series(vals, dtype=object)).tolist() == expected
+    text = [v for v in vals if isinstance(v, str)]
+    assert clean_amount_series(pd.Series(text)).tolist() == [clean_amount(v) for v in text]
+
+
+def test_categorize_series_matches_categorize_difference():
+    texts = [f'Mov {k.upper()} 123' for k in list(PERMANENT_KEYWORDS) + list(TEMPORARY_KEYWORDS)]
+    texts += [
+        'Transferencia por comision',  # temporary keyword first, permanent wins
+        'Sueldo con comision',  # later in the text, earlier in the dict
+        'Tarjeta prisma en transito',
+        'Pago a proveedor',
+        np.nan,
+        None,
+    ]
+    for column in ('Descripcion', 'Concepto'):
+        df = pd.DataFrame({column: texts})
+        for source in ('extracto', 'libro'):
+            series = categorize_series(df, source)
+            rows = [categorize_difference(row, source) for _, row in df.iterrows()]
+            assert series['Cat_is_temporary'].tolist() == [r['is_temporary'] for r in rows]
+            assert series['Cat_subcategory'].tolist() == [r['subcategory'] for r in rows]
+
+
+def test_build_reconciliation_cheque_matches():
+    libro = pd.DataFrame({
+        'Fecha Pago ': pd.to_datetime(['2024-03-01'] * 4),
+        'Concepto': ['Pago (111111)', 'Pago (111111)', 'Cheques (222222) (333333)', 'Pago (111111) (12)'],
+        'Ingreso': [0] * 4,
+        'Egreso': [100.0, 100.0, 300.0, 50.0],
+    })
+    extracto = pd.DataFrame({
+        'Fecha': ['01/03/2024'] * 4,
+        'Descripción': ['Cheque'] * 4,
+        'Créditos': [0] * 4,
+        'Débitos': [100.0, 100.0, 300.0, 300.0],
+        'Número de Comprobante': ['111111', '111111', '333333', '222222'],
+        'Saldo': [0.0] * 4,
+    })
+    _, summary, sheets = build_reconciliation(libro, extracto)
+    matched = sheets['matched']
+    # The same cheque on two bank lines goes to both Libro rows citing it, in
+    # order; a Libro row citing two cheques takes the first one found
+    assert list(zip(matched['Libro_ID'], matched['Banco_ID'])) == [(0, 0), (1, 1), (2, 3)]
+    assert matched['Method'].eq('Cheque').all()
+    assert summary['matches_cheque'] == 3